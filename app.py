@@ -1,9 +1,15 @@
 import os
+import time
+import asyncio
 import logging
-import requests
-from flask import Flask, request
+from types import MappingProxyType
+import httpx
+import orjson
+import re2
+from aiolimiter import AsyncLimiter
+from cachetools import TTLCache
+from quart import Quart, request
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
 # lt --port 3000 --subdomain bootme to port-forward
 
 logging.basicConfig(
@@ -13,13 +19,30 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 load_dotenv()
 
-app = Flask(__name__)
+app = Quart(__name__)
 
 BOT_ID = os.getenv('GROUPME_BOT_ID')
 ACCESS_TOKEN = os.getenv('GROUPME_ACCESS_TOKEN')
 GROUP_ID = os.getenv('GROUPME_GROUP_ID')
 PORT = int(os.getenv('PORT', 3000))
 GROUPME_API = 'https://api.groupme.com/v3'
+BOT_POST_URL = f'{GROUPME_API}/bots/post'
+GROUP_URL = f'{GROUPME_API}/groups/{GROUP_ID}'
+MEMBER_REMOVE_URL = GROUP_URL + '/members/{}/remove'
+MESSAGES_URL = f'{GROUPME_API}/conversations/{GROUP_ID}/messages/'
+# Sent as a header so the token never appears in logged request URLs
+AUTH_HEADERS = MappingProxyType({'X-Access-Token': ACCESS_TOKEN or ''})
+JSON_HEADERS = MappingProxyType({'Content-Type': 'application/json'})
+GROUPME_API_MAX_RATE = 20
+RETRY_STATUSES = frozenset({429, 502, 503})
+# POSTs are only retried on 429, when GroupMe has not acted on the request
+RETRY_METHODS = frozenset({'GET', 'DELETE'})
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 0.3
+HTTP_TIMEOUT_SECONDS = 5.0
+HTTP_CONNECT_TIMEOUT_SECONDS = 2.0
+# Longer Retry-After waits would hold the webhook open, so give up instead
+RETRY_AFTER_MAX_SECONDS = HTTP_TIMEOUT_SECONDS
 BANNED_KEYWORDS = [
     'give out',
     'for free',
@@ -54,140 +77,300 @@ BANNED_KEYWORDS = [
     'interested',
 ]
 
-recently_joined = {}
-NEW_USER_WINDOW_HOURS = 72 
+BANNED_KEYWORDS_LOWER = tuple(keyword.lower() for keyword in BANNED_KEYWORDS)
+MIN_KEYWORD_LEN = min(map(len, BANNED_KEYWORDS_LOWER))
+
+# RE2 compiles the alternation into a single DFA that scans each message once
+BANNED_PATTERN = re2.compile(
+    '(?i)' + '|'.join(re2.escape(keyword) for keyword in BANNED_KEYWORDS_LOWER)
+)
+# Plain substrings, as before, so messages like "rejoined the group" still count
+JOIN_PATTERN = re2.compile(r'(?i)added|joined')
+
+NEW_USER_WINDOW_SECONDS = 72 * 3600
+RECENTLY_JOINED_MAX_SIZE = 10_000
+recently_joined = TTLCache(
+    maxsize=RECENTLY_JOINED_MAX_SIZE,
+    ttl=NEW_USER_WINDOW_SECONDS
+)
+http_client = None
+api_limiter = AsyncLimiter(GROUPME_API_MAX_RATE, 1.0)
+membership_cache = {}
+membership_cache_ts = 0
+membership_refresh_task = None
+background_tasks = set()
+MEMBERSHIP_CACHE_TTL_SECONDS = 5 * 60
+MEMBERSHIP_REFRESH_INTERVAL_SECONDS = 4 * 60
+MEMBERSHIP_PREFETCH_MIN_AGE_SECONDS = 10
+membership_refresh_loop = None
+pending_kicks = {}
+KICK_WINDOW_SECONDS = 2.0
+
+def run_in_background(coro):
+    # Hold a reference so the task is not garbage collected before it finishes
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
 
 def contains_banned_keyword(text):
-    if not text:
+    if not text or len(text) < MIN_KEYWORD_LEN:
         return False
-    text_lower = text.lower()
-    return any(keyword.lower() in text_lower for keyword in BANNED_KEYWORDS)
+    return BANNED_PATTERN.search(text) is not None
 
-def send_bot_message(text):
+@app.before_serving
+async def open_http_client():
+    # One HTTP/2 connection multiplexes every GroupMe call, and the timeouts
+    # keep a slow API response from stalling the webhook
+    global http_client
+    http_client = httpx.AsyncClient(
+        http2=True,
+        headers=AUTH_HEADERS,
+        timeout=httpx.Timeout(HTTP_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+        limits=httpx.Limits(
+            max_connections=100,
+            max_keepalive_connections=20,
+            keepalive_expiry=60
+        )
+    )
+
+@app.after_serving
+async def close_http_client():
+    # Stop the keep-warm loop and let in-flight calls finish before the
+    # client they use is closed
+    membership_refresh_loop.cancel()
+    pending = [membership_refresh_loop, *background_tasks]
+    if membership_refresh_task is not None:
+        pending.append(membership_refresh_task)
+    await asyncio.gather(*pending, return_exceptions=True)
+    await http_client.aclose()
+
+def should_retry(method, status_code):
+    if status_code == 429:
+        return True
+    return status_code in RETRY_STATUSES and method in RETRY_METHODS
+
+def retry_delay(response, attempt):
+    """Seconds to wait before retrying, or None if the server asks for too long"""
+    retry_after = response.headers.get('Retry-After')
+    if retry_after is not None:
+        try:
+            delay = max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+        else:
+            return delay if delay <= RETRY_AFTER_MAX_SECONDS else None
+    return RETRY_BACKOFF_SECONDS * 2 ** attempt
+
+async def groupme_request(method, url, **kwargs):
+    """Rate-limited request on the shared client, retrying transient failures"""
+    for attempt in range(RETRY_ATTEMPTS + 1):
+        async with api_limiter:
+            response = await http_client.request(method, url, **kwargs)
+        if attempt == RETRY_ATTEMPTS or not should_retry(method, response.status_code):
+            return response
+        delay = retry_delay(response, attempt)
+        if delay is None:
+            return response
+        await asyncio.sleep(delay)
+
+async def send_bot_message(text):
     try:
-        response = requests.post(
-            f'{GROUPME_API}/bots/post',
-            json={'bot_id': BOT_ID, 'text': text}
+        response = await groupme_request(
+            'POST',
+            BOT_POST_URL,
+            content=orjson.dumps({'bot_id': BOT_ID, 'text': text}),
+            headers=JSON_HEADERS
         )
         
         if response.status_code == 202:
-            logger.info(f"Message sent: {text}")
+            logger.info("Message sent: %s", text)
             return True
         else:
-            logger.error(f"Failed to send message. Status: {response.json()}")
+            logger.error("Failed to send message. Status: %s", response.text)
             return False
             
-    except requests.RequestException as e:
-        logger.error(f"Error sending message: {e}")
+    except httpx.HTTPError as e:
+        logger.error("Error sending message: %s", e)
+        return False
+
+async def refresh_membership_cache():
+    global membership_cache, membership_cache_ts
+    response = await groupme_request(
+        'GET',
+        GROUP_URL
+    )
+    
+    if response.status_code != 200:
+        logger.error("Failed to get group info. Status: %s", response.text)
         return False
+    
+    group_data = orjson.loads(response.content)['response']
+    
+    membership_cache = {member['user_id']: member['id'] for member in group_data['members']}
+    membership_cache_ts = time.monotonic()
+    return True
+
+def clear_membership_refresh_task(_task):
+    global membership_refresh_task
+    membership_refresh_task = None
 
-def get_membership_id(user_id):
+async def refresh_membership_cache_once():
+    # Concurrent cache misses share a single in-flight group fetch
+    global membership_refresh_task
+    if membership_refresh_task is None:
+        membership_refresh_task = asyncio.create_task(refresh_membership_cache())
+        membership_refresh_task.add_done_callback(clear_membership_refresh_task)
+    return await asyncio.shield(membership_refresh_task)
+
+async def prefetch_membership_ids():
+    # New members are missing from the cache, so refresh it at join time
+    # rather than on the kick path
     try:
-        response = requests.get(
-            f"{GROUPME_API}/groups/{GROUP_ID}",
-            params={'token': ACCESS_TOKEN}
-        )
-        
-        if response.status_code != 200:
-            logger.error(f"Failed to get group info. Status: {response.json()}")
+        await refresh_membership_cache_once()
+    except Exception as e:
+        # Runs as a background task, where a malformed group payload
+        # (JSONDecodeError, KeyError) would otherwise end the keep-warm loop
+        logger.error("Error prefetching membership IDs: %s", e)
+
+async def refresh_membership_cache_periodically():
+    # Refresh ahead of the TTL so kicks are served from a warm cache
+    while True:
+        await prefetch_membership_ids()
+        await asyncio.sleep(MEMBERSHIP_REFRESH_INTERVAL_SECONDS)
+
+@app.before_serving
+async def start_membership_refresh():
+    global membership_refresh_loop
+    membership_refresh_loop = asyncio.create_task(refresh_membership_cache_periodically())
+
+async def get_membership_id(user_id):
+    cache_age = time.monotonic() - membership_cache_ts
+    if user_id in membership_cache and cache_age < MEMBERSHIP_CACHE_TTL_SECONDS:
+        return membership_cache[user_id]
+    
+    try:
+        if not await refresh_membership_cache_once():
             return None
         
-        group_data = response.json()['response']
-        print(group_data)
+        if user_id in membership_cache:
+            return membership_cache[user_id]
         
-        for member in group_data['members']:
-            if member['user_id'] == user_id:
-                return member['id']
-        
-        logger.warning(f"User ID {user_id} not found in group members")
+        logger.warning("User ID %s not found in group members", user_id)
         return None
         
-    except requests.RequestException as e:
-        logger.error(f"Error getting membership ID: {e}")
+    except httpx.HTTPError as e:
+        logger.error("Error getting membership ID: %s", e)
         return None
     
-def delete_message(message_id):
+async def delete_message(message_id):
     try:
-        response = requests.delete(
-            f"{GROUPME_API}/conversations/{GROUP_ID}/messages/{message_id}",
-            params={'token': ACCESS_TOKEN}
+        response = await groupme_request(
+            'DELETE',
+            f'{MESSAGES_URL}{message_id}'
         )
         
         if response.status_code == 204:
-            logger.info(f"Successfully deleted message {message_id}")
+            logger.info("Successfully deleted message %s", message_id)
             return True
         else:
-            logger.error(f"Failed to delete message. Info: {response.json()}")
+            logger.error("Failed to delete message. Info: %s", response.text)
             return False
             
-    except requests.RequestException as e:
-        logger.error(f"Error deleting message: {e}")
+    except httpx.HTTPError as e:
+        logger.error("Error deleting message: %s", e)
         return False
 
-def kick_user(user_id, username):
+async def kick_user(user_id, username):
     try:
-        membership_id = get_membership_id(user_id)
+        membership_id = await get_membership_id(user_id)
         if not membership_id:
-            logger.error(f"Cannot kick user {username}: membership ID not found")
+            logger.error("Cannot kick user %s: membership ID not found", username)
             return False
         
-        response = requests.post(
-            f"{GROUPME_API}/groups/{GROUP_ID}/members/{membership_id}/remove",
-            params={'token': ACCESS_TOKEN}
+        response = await groupme_request(
+            'POST',
+            MEMBER_REMOVE_URL.format(membership_id)
         )
         
         if response.status_code == 200:
-            logger.info(f"Successfully kicked user {username} (ID: {user_id})")
+            logger.info("Successfully kicked user %s (ID: %s)", username, user_id)
+            membership_cache.pop(user_id, None)
             return True
         else:
-            logger.error(f"Failed to kick user {username}. Info: {response.json()}")
+            logger.error("Failed to kick user %s. Info: %s", username, response.text)
             return False
             
-    except requests.RequestException as e:
-        logger.error(f"Error kicking user: {e}")
+    except httpx.HTTPError as e:
+        logger.error("Error kicking user: %s", e)
         return False
 
-def is_new_user(user_id):
-    if user_id not in recently_joined:
-        return False
-    
-    join_time = recently_joined[user_id]
-    time_since_join = datetime.now() - join_time
-    if time_since_join > timedelta(hours=NEW_USER_WINDOW_HOURS):
-        del recently_joined[user_id]
+async def kick_then_notify(user_id, username):
+    try:
+        if await kick_user(user_id, username):
+            message = f"⚠️ User {username} was removed for violating group rules."
+            run_in_background(send_bot_message(message))
+            # A single pop: TTLCache can expire the entry between a membership
+            # check and a del, which would raise KeyError
+            recently_joined.pop(user_id, None)
+    finally:
+        release_kick(user_id)
+
+def claim_kick(user_id):
+    """Return True only for the first violation from a user while a kick is pending"""
+    if user_id in pending_kicks:
         return False
+    pending_kicks[user_id] = time.monotonic()
     return True
 
+def release_kick(user_id):
+    # Hold the claim until the kick finishes, and for at least KICK_WINDOW_SECONDS
+    remaining = KICK_WINDOW_SECONDS - (time.monotonic() - pending_kicks[user_id])
+    if remaining > 0:
+        asyncio.get_running_loop().call_later(remaining, pending_kicks.pop, user_id, None)
+    else:
+        pending_kicks.pop(user_id, None)
+
+def is_new_user(user_id):
+    # Entries older than NEW_USER_WINDOW_SECONDS are expired by the cache itself
+    return user_id in recently_joined
+
 @app.route('/webhook', methods=['POST'])
-def webhook():
+async def webhook():
     try:
-        data = request.get_json()        
-        text = data.get('text', '')
+        data = orjson.loads(await request.get_data())
+        text = data.get('text') or ''
         user_id = data.get('user_id')
         username = data.get('name', 'Unknown')
         message_id = data.get('id')
 
         if data.get('system'):
-            if 'added' in text.lower() or 'joined' in text.lower():
-                recently_joined[user_id] = datetime.now()
-                logger.info(f"User {username} joined the group")
+            if JOIN_PATTERN.search(text):
+                recently_joined[user_id] = time.monotonic()
+                # During a join raid one recent refresh serves every joiner; a
+                # user it missed is picked up by the refresh on a kick-time miss
+                if time.monotonic() - membership_cache_ts >= MEMBERSHIP_PREFETCH_MIN_AGE_SECONDS:
+                    run_in_background(prefetch_membership_ids())
+                logger.info("User %s joined the group", username)
                 return '', 200
               
-        if contains_banned_keyword(text) and is_new_user(user_id):
+        # A user already being kicked may have left recently_joined, but any
+        # burst of spam they sent inside the window still gets deleted
+        is_suspect = is_new_user(user_id) or user_id in pending_kicks
+        if is_suspect and contains_banned_keyword(text):
+            actions = []
             if message_id:
-                delete_message(message_id)
-            if kick_user(user_id, username):
-                message = f"⚠️ User {username} was removed for violating group rules."
-                send_bot_message(message)
-                if user_id in recently_joined:
-                    del recently_joined[user_id]
+                actions.append(delete_message(message_id))
+            if claim_kick(user_id):
+                actions.append(kick_then_notify(user_id, username))
+            await asyncio.gather(*actions)
         return '', 200
     except Exception as e:
-        logger.error(f"Error processing webhook: {e}")
+        logger.error("Error processing webhook: %s", e)
         return '', 500
 
 @app.route('/', methods=['GET'])
-def index():
+async def index():
     """Basic status page"""
     return f'''
     <h1>GroupMe Moderation Bot</h1>
@@ -195,11 +378,12 @@ def index():
     <p>Monitoring keywords: {len(BANNED_KEYWORDS)}</p>
     ''', 200
 
+# Local development only; production is served by gunicorn (see Procfile)
 if __name__ == '__main__':
     try:        
-        logger.info(f"Starting GroupMe bot on port {PORT}")        
+        logger.info("Starting GroupMe bot on port %s", PORT)        
         app.run(host='0.0.0.0', port=PORT, debug=False)
         
     except Exception as e:
-        logger.error(f"Failed to start bot: {e}")
+        logger.error("Failed to start bot: %s", e)
         exit(1)
\ No newline at end of file
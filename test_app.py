@@ -0,0 +1,245 @@
+import asyncio
+
+import httpx
+
+import app
+
+
+def test_concurrent_membership_misses_share_one_fetch(monkeypatch):
+    monkeypatch.setattr(app, 'membership_cache', {})
+    monkeypatch.setattr(app, 'membership_cache_ts', 0)
+    fetches = []
+
+    async def fake_refresh():
+        fetches.append(1)
+        await asyncio.sleep(0.01)
+        app.membership_cache = {'u1': 'm1', 'u2': 'm2'}
+        app.membership_cache_ts = app.time.monotonic()
+        return True
+
+    monkeypatch.setattr(app, 'refresh_membership_cache', fake_refresh)
+
+    async def scenario():
+        return await asyncio.gather(
+            app.get_membership_id('u1'),
+            app.get_membership_id('u2'),
+            app.get_membership_id('u1'),
+        )
+
+    assert asyncio.run(scenario()) == ['m1', 'm2', 'm1']
+    assert len(fetches) == 1
+
+
+def run_with_responses(monkeypatch, method, responses):
+    monkeypatch.setattr(app, 'RETRY_BACKOFF_SECONDS', 0)
+    calls = []
+
+    def handler(request):
+        calls.append(request.method)
+        return responses[len(calls) - 1]
+
+    async def scenario():
+        monkeypatch.setattr(app, 'api_limiter', app.AsyncLimiter(app.GROUPME_API_MAX_RATE, 1.0))
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            monkeypatch.setattr(app, 'http_client', client)
+            response = await app.groupme_request(method, app.GROUP_URL)
+        return response.status_code
+
+    return asyncio.run(scenario()), calls
+
+
+def test_get_retried_on_server_error(monkeypatch):
+    status, calls = run_with_responses(monkeypatch, 'GET', [
+        httpx.Response(502), httpx.Response(503), httpx.Response(200),
+    ])
+    assert status == 200
+    assert len(calls) == 3
+
+
+def test_post_not_retried_on_server_error(monkeypatch):
+    status, calls = run_with_responses(monkeypatch, 'POST', [
+        httpx.Response(502), httpx.Response(202),
+    ])
+    assert status == 502
+    assert len(calls) == 1
+
+
+def test_post_retried_on_rate_limit(monkeypatch):
+    status, calls = run_with_responses(monkeypatch, 'POST', [
+        httpx.Response(429, headers={'Retry-After': '0'}), httpx.Response(202),
+    ])
+    assert status == 202
+    assert len(calls) == 2
+
+
+def test_long_retry_after_returns_rate_limit(monkeypatch):
+    status, calls = run_with_responses(monkeypatch, 'GET', [
+        httpx.Response(429, headers={'Retry-After': '3600'}), httpx.Response(200),
+    ])
+    assert status == 429
+    assert len(calls) == 1
+
+
+def test_retry_delay_prefers_retry_after():
+    response = httpx.Response(429, headers={'Retry-After': '5'})
+    assert app.retry_delay(response, 0) == 5.0
+    response = httpx.Response(429, headers={'Retry-After': '2'})
+    assert app.retry_delay(response, 0) == 2.0
+    response = httpx.Response(429, headers={'Retry-After': '3600'})
+    assert app.retry_delay(response, 0) is None
+    assert app.retry_delay(httpx.Response(503), 2) == app.RETRY_BACKOFF_SECONDS * 4
+
+
+def test_kick_claim_held_until_kick_finishes(monkeypatch):
+    monkeypatch.setattr(app, 'pending_kicks', {})
+    monkeypatch.setattr(app, 'KICK_WINDOW_SECONDS', 0.01)
+
+    async def scenario():
+        kick_done = asyncio.Event()
+
+        async def slow_kick(user_id, username):
+            await kick_done.wait()
+            return False
+
+        monkeypatch.setattr(app, 'kick_user', slow_kick)
+        assert app.claim_kick('u1')
+        kick = asyncio.create_task(app.kick_then_notify('u1', 'spammer'))
+        await asyncio.sleep(0.05)
+        # Window has passed but the kick is still running
+        assert not app.claim_kick('u1')
+        kick_done.set()
+        await kick
+        assert app.claim_kick('u1')
+
+    asyncio.run(scenario())
+
+
+def test_kick_claim_held_for_full_window(monkeypatch):
+    monkeypatch.setattr(app, 'pending_kicks', {})
+    monkeypatch.setattr(app, 'KICK_WINDOW_SECONDS', 0.05)
+
+    async def fast_kick(user_id, username):
+        return False
+
+    monkeypatch.setattr(app, 'kick_user', fast_kick)
+
+    async def scenario():
+        assert app.claim_kick('u1')
+        await app.kick_then_notify('u1', 'spammer')
+        assert not app.claim_kick('u1')
+        await asyncio.sleep(0.1)
+        assert app.claim_kick('u1')
+
+    asyncio.run(scenario())
+
+
+def post_join(monkeypatch, cache_ts):
+    monkeypatch.setattr(app, 'membership_cache_ts', cache_ts)
+    monkeypatch.setattr(app, 'recently_joined', {})
+    prefetches = []
+
+    async def fake_prefetch():
+        prefetches.append(1)
+
+    monkeypatch.setattr(app, 'prefetch_membership_ids', fake_prefetch)
+
+    async def scenario():
+        client = app.app.test_client()
+        response = await client.post('/webhook', json={
+            'system': True,
+            'text': 'Alice has joined the group',
+            'user_id': 'u1',
+            'name': 'Alice',
+        })
+        await asyncio.gather(*app.background_tasks)
+        return response.status_code
+
+    assert asyncio.run(scenario()) == 200
+    assert 'u1' in app.recently_joined
+    return len(prefetches)
+
+
+def test_join_prefetches_membership_ids(monkeypatch):
+    assert post_join(monkeypatch, 0) == 1
+
+
+def test_join_skips_prefetch_after_recent_refresh(monkeypatch):
+    assert post_join(monkeypatch, app.time.monotonic()) == 0
+
+
+def baseline_contains_banned_keyword(text):
+    # The original substring check the compiled pattern replaced
+    if not text:
+        return False
+    text_lower = text.lower()
+    return any(keyword.lower() in text_lower for keyword in app.BANNED_KEYWORDS)
+
+
+def test_banned_pattern_matches_baseline_check():
+    texts = [
+        None,
+        '',
+        'so',
+        'ps',
+        'PS5',
+        'Free MacBook Air, charger included',
+        'I LOST MY SON last year',
+        'No Mother Should go through this',
+        'send me a message on GMAIL',
+        'text   me',
+        'hello there, see you at practice',
+        'Gaming\nSystem',
+    ]
+    for text in texts:
+        assert app.contains_banned_keyword(text) == baseline_contains_banned_keyword(text), text
+
+
+def test_banned_pattern_folds_unicode_case():
+    # Intended difference from the old check: RE2 applies Unicode case folding,
+    # so look-alike letters such as the long s still match
+    assert app.contains_banned_keyword('\u017fon')
+    assert not baseline_contains_banned_keyword('\u017fon')
+
+
+def test_join_pattern_matches_rejoined():
+    assert app.JOIN_PATTERN.search('Alice has rejoined the group')
+    assert app.JOIN_PATTERN.search('Bob added Carol to the group')
+    assert not app.JOIN_PATTERN.search('hello everyone')
+
+
+def test_access_token_kept_out_of_urls_and_logs(monkeypatch, caplog):
+    monkeypatch.setattr(app, 'AUTH_HEADERS', {'X-Access-Token': 'SECRET123'})
+    monkeypatch.setattr(app, 'membership_cache', {})
+    monkeypatch.setattr(app, 'membership_cache_ts', 0)
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        if request.method == 'GET':
+            body = {'response': {'members': [{'user_id': 'u1', 'id': 'm1'}]}}
+            return httpx.Response(200, json=body)
+        return httpx.Response(204 if request.method == 'DELETE' else 200)
+
+    real_client = httpx.AsyncClient
+    monkeypatch.setattr(
+        app.httpx, 'AsyncClient',
+        lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs)
+    )
+
+    async def scenario():
+        monkeypatch.setattr(app, 'api_limiter', app.AsyncLimiter(app.GROUPME_API_MAX_RATE, 1.0))
+        await app.open_http_client()
+        try:
+            assert await app.delete_message('msg1')
+            assert await app.kick_user('u1', 'spammer')
+        finally:
+            await app.http_client.aclose()
+
+    caplog.set_level('DEBUG')
+    asyncio.run(scenario())
+    assert [request.method for request in seen] == ['DELETE', 'GET', 'POST']
+    for request in seen:
+        assert request.headers['X-Access-Token'] == 'SECRET123'
+        assert 'SECRET123' not in str(request.url)
+    assert caplog.records
+    assert not any('SECRET123' in record.getMessage() for record in caplog.records)